@@ -9,7 +9,35 @@
 
 import streamlit as st
 import pandas as pd
+import numpy as np
+import math
+import re
+import warnings
+from array import array
+from itertools import islice
 from io import BytesIO
+from openpyxl import Workbook, load_workbook
+from openpyxl.utils.cell import coordinate_from_string, column_index_from_string
+
+try:
+    from python_calamine import CalamineWorkbook
+except ImportError:  # optional Rust-backed reader, openpyxl read-only mode otherwise
+    CalamineWorkbook = None
+
+try:
+    from numba import njit, prange
+except ImportError:  # optional JIT for large tables, NumPy broadcasting otherwise
+    njit = None
+
+try:
+    from rustpy_xlsxwriter import FastExcel
+except ImportError:  # optional Rust-backed writer
+    FastExcel = None
+
+try:
+    import xlsxwriter
+except ImportError:  # optional, openpyxl write-only mode is the last resort
+    xlsxwriter = None
 
 st.set_page_config(page_title="Pump Flow Converter by Dhanush", layout="centered", page_icon="💧")
 st.title("Pump Affinity Converter — Upload Excel → Download")
@@ -32,74 +60,225 @@ decimals = st.number_input("Round output to how many decimal places?", min_value
 
 MIN_DIAS = 3
 
-def read_uploaded_excel(file_buffer, auto_detect=True, orig_cell="D1"):
-    df_raw = pd.read_excel(file_buffer, engine="openpyxl", header=None)
-    orig_value = None
-    if orig_cell:
-        try:
-            col_letter = ''.join([c for c in orig_cell if c.isalpha()])
-            row_number = int(''.join([c for c in orig_cell if c.isdigit()]))
-            col_idx = ord(col_letter.upper()) - ord('A')
-            row_idx = row_number - 1
-            val = df_raw.iat[row_idx, col_idx]
-            if not pd.isna(val):
-                orig_value = float(val)
-        except Exception:
-            orig_value = None
-
+def _read_columns(rows, auto_detect):
+    # rows are (A, B, C) values from row 2 down; blanks are None (openpyxl) or "" (calamine)
+    if not auto_detect:
+        rows = islice(rows, 5)
+    buf = array("d")
+    for row in rows:
+        for v in row:
+            buf.append(np.nan if v in (None, "") else float(v))
+    vals = np.frombuffer(buf).reshape(-1, 3)
     if auto_detect:
-        flows = df_raw.iloc[1:, 0].dropna().astype(float).reset_index(drop=True)
-        heads = df_raw.iloc[1:, 1].dropna().astype(float).reset_index(drop=True)
-        powers = df_raw.iloc[1:, 2].dropna().astype(float).reset_index(drop=True)
-        n = min(len(flows), len(heads), len(powers))
-        flows, heads, powers = flows[:n], heads[:n], powers[:n]
+        mask = np.isnan(vals).any(axis=1)
+        n = int(mask.argmax()) if mask.any() else len(vals)
+        vals = vals[:n]
+    return vals[:, 0], vals[:, 1], vals[:, 2]
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def read_uploaded_excel(file_bytes, auto_detect=True, orig_cell="D1"):
+    wb = None
+    if CalamineWorkbook is not None:
+        # calamine decodes the first sheet once in Rust, anchored at A1
+        grid = CalamineWorkbook.from_filelike(BytesIO(file_bytes)).get_sheet_by_index(0).to_python(skip_empty_area=False)
+        cell = lambda row_idx, col_idx: grid[row_idx][col_idx]
+        rows = ((row + ["", "", ""])[:3] for row in grid[1:])
     else:
-        flows = df_raw.loc[1:5, 0].astype(float).reset_index(drop=True)
-        heads = df_raw.loc[1:5, 1].astype(float).reset_index(drop=True)
-        powers = df_raw.loc[1:5, 2].astype(float).reset_index(drop=True)
+        # read-only mode streams rows lazily instead of building a Cell for every cell
+        wb = load_workbook(BytesIO(file_bytes), read_only=True, data_only=True)
+        ws = wb.worksheets[0]
+        cell = lambda row_idx, col_idx: ws.cell(row=row_idx + 1, column=col_idx + 1).value
+        rows = ws.iter_rows(min_row=2, max_col=3, values_only=True)
+
+    try:
+        orig_value = None
+        if orig_cell:
+            try:
+                # handles multi-letter columns (AA1) and absolute refs ($D$1)
+                col_letter, row_number = coordinate_from_string(orig_cell.strip())
+                col_idx = column_index_from_string(col_letter) - 1
+                row_idx = row_number - 1
+                val = cell(row_idx, col_idx)
+                if val not in (None, ""):
+                    orig_value = float(val)
+            except Exception:
+                orig_value = None
+
+        # only columns A/B/C are used, collected into one flat double buffer
+        flows, heads, powers = _read_columns(rows, auto_detect)
+    finally:
+        if wb is not None:
+            wb.close()
 
     df = pd.DataFrame({"Flow_orig": flows, "Head_orig": heads, "Power_orig_kW": powers})
     return df, orig_value
 
+# above this many output cells per quantity the fused kernel beats NumPy's temporaries
+NUMBA_MIN_CELLS = 100_000
+
+if njit is not None:
+    # no fastmath: blank inputs arrive as NaN and must stay NaN
+    @njit(parallel=True, cache=True)
+    def _affinity_kernel(orig, r, out):
+        for i in prange(orig.shape[0]):
+            f = orig[i, 0]
+            h = orig[i, 1]
+            p = orig[i, 2]
+            for k in range(r.shape[0]):
+                rk = r[k]
+                rk2 = rk * rk
+                rk3 = rk2 * rk
+                out[i, k, 0] = f * rk
+                out[i, k, 1] = h * rk2
+                out[i, k, 2] = p * rk3
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def _compute(flow, head, power, D_orig, dias):
+    """
+    Returns the (N, K*3) block of Flow/Head/Power, one group per new diameter.
+    Cached on the raw readings, so writer-only settings never recompute it.
+    """
+    orig = np.column_stack([flow, head, power])
+    r = np.asarray(dias, dtype=np.float64) / D_orig
+    block = np.empty((orig.shape[0], len(r), 3))
+    if njit is not None and orig.shape[0] * len(r) > NUMBA_MIN_CELLS:
+        # one fused pass writing Flow/Head/Power per diameter straight into place
+        _affinity_kernel(orig, r, block)
+    else:
+        r2 = r * r
+        # (N, K) results written into their interleaved slots, no temporaries
+        np.multiply(orig[:, 0:1], r, out=block[:, :, 0])
+        np.multiply(orig[:, 1:2], r2, out=block[:, :, 1])
+        np.multiply(orig[:, 2:3], r2 * r, out=block[:, :, 2])
+    # (N, K, 3) -> Flow/Head/Power per diameter
+    return block.reshape(orig.shape[0], len(r) * 3)
+
 def apply_affinity(df, D_orig, new_dias):
-    out = df.copy()
+    base = df[["Flow_orig", "Head_orig", "Power_orig_kW"]].to_numpy(dtype=np.float64, copy=False)
+    block = _compute(base[:, 0], base[:, 1], base[:, 2], D_orig, tuple(new_dias))
+    cols = ["Flow_orig", "Head_orig", "Power_orig_kW"]
     for D in new_dias:
-        ratio = D / D_orig
-        out[f"Flow_D{D}"] = out["Flow_orig"] * ratio
-        out[f"Head_D{D}"] = out["Head_orig"] * (ratio**2)
-        out[f"Power_kW_D{D}"] = out["Power_orig_kW"] * (ratio**3)
-    return out
+        cols += [f"Flow_D{D}", f"Head_D{D}", f"Power_kW_D{D}"]
+    return pd.DataFrame(np.hstack([base, block]), columns=cols, index=df.index, copy=False)
+
+def _excel_value(v, decimals=None):
+    # like DataFrame.to_excel: NaN is left blank, inf/-inf are written as text
+    if math.isfinite(v):
+        return v if decimals is None else round(v, decimals)
+    return None if math.isnan(v) else str(v)
 
-def build_excel_bytes(df_orig, df_out, D_orig, new_dias, per_sheet=False, decimals=4):
+def _excel_rows(frame, decimals=None):
+    # header first, then values
+    yield list(frame.columns)
+    for row in frame.itertuples(index=False, name=None):
+        yield [_excel_value(v, decimals) for v in row]
+
+def write_excel_sheets(buf, sheets, decimals=None):
+    """
+    Writes (sheet_name, DataFrame) pairs to buf as an xlsx workbook.
+    Uses rustpy-xlsxwriter if installed, then xlsxwriter in constant_memory mode,
+    then openpyxl in write-only mode.
+    If decimals is given, values are shown rounded through a number format
+    (openpyxl write-only cells carry no shared format, so there they are rounded).
+    """
+    num_format = None
+    if decimals is not None:
+        num_format = "0." + "0" * decimals if decimals > 0 else "0"
+    if FastExcel is not None:
+        writer = FastExcel(buf).format(float_format=num_format, inf_value="inf")
+        for sheet_name, frame in sheets:
+            # FastExcel writes a non-default index as an extra column
+            writer.sheet(sheet_name, frame.reset_index(drop=True))
+        writer.save()
+    elif xlsxwriter is not None:
+        # constant_memory flushes rows as they are written, so write strictly row by row
+        wb = xlsxwriter.Workbook(buf, {"constant_memory": True})
+        fmt = wb.add_format({"num_format": num_format}) if num_format else None
+        for sheet_name, frame in sheets:
+            ws = wb.add_worksheet(sheet_name)
+            for i, row in enumerate(_excel_rows(frame)):
+                ws.write_row(i, 0, row, fmt if i else None)
+        wb.close()
+    else:
+        wb = Workbook(write_only=True)
+        for sheet_name, frame in sheets:
+            ws = wb.create_sheet(sheet_name)
+            for row in _excel_rows(frame, decimals):
+                ws.append(row)
+        wb.save(buf)
+
+def build_excel_bytes(df_orig, df_out, new_dias, per_sheet=False, decimals=4):
     """
     Returns BytesIO Excel file.
     If per_sheet True: writes one sheet per new diameter (sheet name D{diam})
     Otherwise writes a single sheet with df_out
     """
+    sheets = []
+    if per_sheet:
+        # original data sheet
+        sheets.append(("original", df_orig))
+        # df_out from apply_affinity holds the originals, then Flow/Head/Power per diameter
+        vals = df_out.to_numpy(dtype=np.float64, copy=False)
+        for i, D in enumerate(new_dias):
+            k = 3 + 3 * i
+            temp = pd.DataFrame({
+                "Flow_orig": vals[:, 0],
+                "Head_orig": vals[:, 1],
+                "Power_orig_kW": vals[:, 2],
+                f"Flow_D{D}": vals[:, k],
+                f"Head_D{D}": vals[:, k + 1],
+                f"Power_kW_D{D}": vals[:, k + 2]
+            }, copy=False)
+            sheet_name = f"D{int(D) if float(D).is_integer() else D}"
+            # ensure sheet name length <= 31
+            sheet_name = sheet_name[:31]
+            sheets.append((sheet_name, temp))
+    else:
+        sheets.append(("converted", df_out))
+
     buf = BytesIO()
-    with pd.ExcelWriter(buf, engine="openpyxl") as writer:
-        if per_sheet:
-            # write original data sheet
-            df_orig.round(decimals).to_excel(writer, sheet_name="original", index=False)
-            # for each new diameter, compute Q,H,P columns and write sheet
-            for D in new_dias:
-                ratio = D / D_orig
-                temp = df_orig.copy()
-                temp[f"Flow_D{D}"] = (temp["Flow_orig"] * ratio).round(decimals)
-                temp[f"Head_D{D}"] = (temp["Head_orig"] * (ratio**2)).round(decimals)
-                temp[f"Power_kW_D{D}"] = (temp["Power_orig_kW"] * (ratio**3)).round(decimals)
-                sheet_name = f"D{int(D) if float(D).is_integer() else D}"
-                # ensure sheet name length <= 31
-                sheet_name = sheet_name[:31]
-                temp.to_excel(writer, sheet_name=sheet_name, index=False)
-        else:
-            df_out.round(decimals).to_excel(writer, sheet_name="converted", index=False)
+    write_excel_sheets(buf, sheets, decimals)
     buf.seek(0)
     return buf
 
+def parse_diameters(text):
+    """
+    Parses comma-separated diameters into a float64 array in one C pass.
+    Empty items are skipped and repeated diameters are kept once, in order.
+    Raises ValueError on malformed input.
+    """
+    # collapse the separators (and any empty items between them) to single commas
+    text = re.sub(r"\s*,[\s,]*", ",", text.strip(" \t,"))
+    with warnings.catch_warnings():
+        # older NumPy only warns and returns the part it could read
+        warnings.simplefilter("error", DeprecationWarning)
+        try:
+            dias = np.fromstring(text, sep=",", dtype=np.float64)
+        except DeprecationWarning as e:
+            raise ValueError(str(e)) from e
+    # a repeat would produce duplicate result column names
+    _, first = np.unique(dias, return_index=True)
+    return dias[np.sort(first)]
+
+def preview_columns(new_dias):
+    """
+    Returns (flow_cols, head_cols, power_cols) for the preview charts.
+    Kept in session_state so reruns with the same diameters reuse them.
+    """
+    key = tuple(new_dias)
+    cached = st.session_state.get("preview_columns")
+    if cached is None or cached[0] != key:
+        groups = (
+            ["Flow_orig"] + [f"Flow_D{D}" for D in new_dias],
+            ["Head_orig"] + [f"Head_D{D}" for D in new_dias],
+            ["Power_orig_kW"] + [f"Power_kW_D{D}" for D in new_dias],
+        )
+        st.session_state["preview_columns"] = cached = (key, groups)
+    return cached[1]
+
 if uploaded:
     try:
-        df_in, orig_cell_value = read_uploaded_excel(uploaded, auto_detect=detect_range, orig_cell=(cell_addr if auto_read_cell else None))
+        df_in, orig_cell_value = read_uploaded_excel(uploaded.getvalue(), auto_detect=detect_range, orig_cell=(cell_addr if auto_read_cell else None))
     except Exception as e:
         st.error("Failed to read uploaded Excel. Ensure columns A/B/C contain numeric values and file is a valid Excel.")
         st.exception(e)
@@ -120,15 +299,19 @@ if uploaded:
 
     # parse new diameters
     try:
-        new_dias = [float(x.strip()) for x in new_dias_input.split(",") if x.strip() != ""]
+        new_dias = parse_diameters(new_dias_input)
     except Exception:
         st.error("Couldn't parse new diameters. Enter comma-separated numbers like: 180,160,140")
         st.stop()
 
-    if len(new_dias) < MIN_DIAS:
+    if new_dias.size < MIN_DIAS:
         st.error(f"Please provide at least {MIN_DIAS} new diameters.")
         st.stop()
 
+    if not np.all(new_dias > 0):
+        st.error("New diameters must be positive numbers.")
+        st.stop()
+
     if orig_dia is None or orig_dia <= 0:
         st.error("Original impeller OD must be a positive number.")
         st.stop()
@@ -140,23 +323,20 @@ if uploaded:
     st.subheader("Preview charts (first rows)")
     # Show Flow comparison chart for first 5 rows
     try:
-        preview = df_out.head(10).copy()
-        # create a small table for charts: index + Flow columns selected
-        chart_df = preview[["Flow_orig"] + [c for c in preview.columns if c.startswith("Flow_D")]]
+        preview = df_out.head(10)
+        flow_cols, head_cols, power_cols = preview_columns(new_dias)
         st.write("Flow preview")
-        st.line_chart(chart_df)
-        chart_df2 = preview[["Head_orig"] + [c for c in preview.columns if c.startswith("Head_D")]]
+        st.line_chart(preview[flow_cols])
         st.write("Head preview")
-        st.line_chart(chart_df2)
-        chart_df3 = preview[["Power_orig_kW"] + [c for c in preview.columns if c.startswith("Power_kW_D")]]
+        st.line_chart(preview[head_cols])
         st.write("Power preview")
-        st.line_chart(chart_df3)
+        st.line_chart(preview[power_cols])
     except Exception:
         st.info("Could not generate preview charts for this dataset (maybe too few rows).")
 
     # Prepare download
     if st.button("Generate & Download Excel"):
-        out_bytes = build_excel_bytes(df_in, df_out, float(orig_dia), new_dias, per_sheet=export_per_sheet, decimals=int(decimals))
+        out_bytes = build_excel_bytes(df_in, df_out, new_dias, per_sheet=export_per_sheet, decimals=int(decimals))
         default_name = "output_converted.xlsx"
         st.success("Converted file ready")
         st.download_button(
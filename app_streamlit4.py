@@ -1,6 +1,33 @@
 import streamlit as st
+import altair as alt
 import pandas as pd
+import numpy as np
+import math
+import re
+import warnings
 from io import BytesIO
+from openpyxl import Workbook
+
+try:
+    import python_calamine  # enables pandas' engine="calamine"
+    EXCEL_READ_ENGINE = "calamine"
+except ImportError:
+    EXCEL_READ_ENGINE = "openpyxl"
+
+try:
+    from numba import njit, prange
+except ImportError:  # optional JIT for large tables, NumPy broadcasting otherwise
+    njit = None
+
+try:
+    from rustpy_xlsxwriter import FastExcel
+except ImportError:  # optional Rust-backed writer
+    FastExcel = None
+
+try:
+    import xlsxwriter
+except ImportError:  # optional, openpyxl write-only mode is the last resort
+    xlsxwriter = None
 
 # --- Page setup ---
 st.set_page_config(page_title="Flow Calculator - By Dhanush (FPL)", layout="centered", page_icon="💧")
@@ -25,22 +52,140 @@ new_dias_input = st.text_input("New impeller diameters (comma-separated, e.g., 1
 decimals = st.number_input("Round results to how many decimal places?", min_value=0, max_value=6, value=2, step=1)
 
 # --- Helper functions ---
+def parse_diameters(text):
+    """
+    Parses comma-separated diameters into a float64 array in one C pass.
+    Empty items are skipped and repeated diameters are kept once, in order.
+    Raises ValueError on malformed input.
+    """
+    # collapse the separators (and any empty items between them) to single commas
+    text = re.sub(r"\s*,[\s,]*", ",", text.strip(" \t,"))
+    with warnings.catch_warnings():
+        # older NumPy only warns and returns the part it could read
+        warnings.simplefilter("error", DeprecationWarning)
+        try:
+            dias = np.fromstring(text, sep=",", dtype=np.float64)
+        except DeprecationWarning as e:
+            raise ValueError(str(e)) from e
+    # a repeat would produce duplicate result column names
+    _, first = np.unique(dias, return_index=True)
+    return dias[np.sort(first)]
+
+def build_baseline(flows, heads, powers, index=None):
+    # baseline readings plus their efficiency, built as one frame
+    with np.errstate(divide="ignore", invalid="ignore"):
+        eff = (0.0001409 * flows * heads / powers) * 100
+    return pd.DataFrame({
+        "Flow_input": flows,
+        "Head_m": heads,
+        "Power_input_kW": powers,
+        "Efficiency_%": eff
+    }, index=index)
+
+# above this many output cells per quantity the fused kernel beats NumPy's temporaries
+NUMBA_MIN_CELLS = 100_000
+
+if njit is not None:
+    # no fastmath: zero-power rows rely on inf/NaN efficiency
+    @njit(parallel=True, cache=True)
+    def _affinity_kernel(orig, r, out):
+        for i in prange(orig.shape[0]):
+            f = orig[i, 0]
+            h = orig[i, 1]
+            p = orig[i, 2]
+            e = (0.0001409 * f * h / p) * 100
+            for k in range(r.shape[0]):
+                rk = r[k]
+                rk2 = rk * rk
+                rk3 = rk2 * rk
+                out[i, k, 0] = f * rk
+                out[i, k, 1] = h * rk2
+                out[i, k, 2] = p * rk3
+                out[i, k, 3] = e
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def _compute(flow, head, power, D_orig, dias):
+    """
+    Returns the (N, K*4) block of Flow/Head/Power/Efficiency, one group per new diameter.
+    Cached on the raw readings, so rounding never recomputes it.
+    """
+    orig = np.column_stack([flow, head, power])
+    r = np.asarray(dias, dtype=np.float64) / D_orig
+    block = np.empty((orig.shape[0], len(r), 4))
+    if njit is not None and orig.shape[0] * len(r) > NUMBA_MIN_CELLS:
+        # one fused pass writing Flow/Head/Power/Efficiency per diameter straight into place
+        _affinity_kernel(orig, r, block)
+    else:
+        r2 = r * r
+        # (N, K) results written into their interleaved slots, no temporaries
+        np.multiply(orig[:, 0:1], r, out=block[:, :, 0])
+        np.multiply(orig[:, 1:2], r2, out=block[:, :, 1])
+        np.multiply(orig[:, 2:3], r2 * r, out=block[:, :, 2])
+        # Flow*Head/Power scales by r * r^2 / r^3 == 1, so every diameter keeps the baseline efficiency
+        with np.errstate(divide="ignore", invalid="ignore"):
+            eff = (0.0001409 * orig[:, 0] * orig[:, 1] / orig[:, 2]) * 100
+        block[:, :, 3] = eff[:, None]
+    # (N, K, 4) -> Flow/Head/Power/Efficiency per diameter
+    return block.reshape(orig.shape[0], len(r) * 4)
+
 def apply_affinity(df, D_orig, new_dias):
-    out = df.copy()
+    orig = df[["Flow_input", "Head_m", "Power_input_kW"]].to_numpy(dtype=np.float64, copy=False)
+    block = _compute(orig[:, 0], orig[:, 1], orig[:, 2], D_orig, tuple(new_dias))
+    cols = list(df.columns)
     for D in new_dias:
-        ratio = D / D_orig
-        out[f"Flow_D{D}"] = out["Flow_input"] * ratio
-        out[f"Head_D{D}"] = out["Head_m"] * (ratio ** 2)
-        out[f"Power_kW_D{D}"] = out["Power_input_kW"] * (ratio ** 3)
-        out[f"Efficiency_D{D}"] = (
-            (0.0001409 * out[f"Flow_D{D}"] * out[f"Head_D{D}"] / out[f"Power_kW_D{D}"]) * 100
-        )
-    return out
+        cols += [f"Flow_D{D}", f"Head_D{D}", f"Power_kW_D{D}", f"Efficiency_D{D}"]
+    data = np.hstack([df.to_numpy(dtype=np.float64, copy=False), block])
+    return pd.DataFrame(data, columns=cols, index=df.index, copy=False)
+
+def _excel_value(v, decimals=None):
+    # like DataFrame.to_excel: NaN is left blank, inf/-inf are written as text
+    if math.isfinite(v):
+        return v if decimals is None else round(v, decimals)
+    return None if math.isnan(v) else str(v)
+
+def _excel_rows(frame, decimals=None):
+    # header first, then values
+    yield list(frame.columns)
+    for row in frame.itertuples(index=False, name=None):
+        yield [_excel_value(v, decimals) for v in row]
+
+def write_excel_sheets(buf, sheets, decimals=None):
+    """
+    Writes (sheet_name, DataFrame) pairs to buf as an xlsx workbook.
+    Uses rustpy-xlsxwriter if installed, then xlsxwriter in constant_memory mode,
+    then openpyxl in write-only mode.
+    If decimals is given, values are shown rounded through a number format
+    (openpyxl write-only cells carry no shared format, so there they are rounded).
+    """
+    num_format = None
+    if decimals is not None:
+        num_format = "0." + "0" * decimals if decimals > 0 else "0"
+    if FastExcel is not None:
+        writer = FastExcel(buf).format(float_format=num_format, inf_value="inf")
+        for sheet_name, frame in sheets:
+            # FastExcel writes a non-default index as an extra column
+            writer.sheet(sheet_name, frame.reset_index(drop=True))
+        writer.save()
+    elif xlsxwriter is not None:
+        # constant_memory flushes rows as they are written, so write strictly row by row
+        wb = xlsxwriter.Workbook(buf, {"constant_memory": True})
+        fmt = wb.add_format({"num_format": num_format}) if num_format else None
+        for sheet_name, frame in sheets:
+            ws = wb.add_worksheet(sheet_name)
+            for i, row in enumerate(_excel_rows(frame)):
+                ws.write_row(i, 0, row, fmt if i else None)
+        wb.close()
+    else:
+        wb = Workbook(write_only=True)
+        for sheet_name, frame in sheets:
+            ws = wb.create_sheet(sheet_name)
+            for row in _excel_rows(frame, decimals):
+                ws.append(row)
+        wb.save(buf)
 
 def build_excel_bytes(df_out, decimals=2):
     buf = BytesIO()
-    with pd.ExcelWriter(buf, engine="openpyxl") as writer:
-        df_out.round(decimals).to_excel(writer, sheet_name="Results", index=False)
+    write_excel_sheets(buf, [("Results", df_out)], decimals)
     buf.seek(0)
     return buf
 
@@ -51,21 +196,14 @@ if mode == "📁 Upload Excel File":
 
     if uploaded:
         try:
-            df_in = pd.read_excel(uploaded, engine="openpyxl", header=None)
-            flows = df_in.iloc[:, 0].dropna().astype(float).reset_index(drop=True)
-            heads = df_in.iloc[:, 1].dropna().astype(float).reset_index(drop=True)
-            powers = df_in.iloc[:, 2].dropna().astype(float).reset_index(drop=True)
-
-            n = min(len(flows), len(heads), len(powers))
-            df_baseline = pd.DataFrame({
-                "Flow_input": flows[:n],
-                "Head_m": heads[:n],
-                "Power_input_kW": powers[:n]
-            })
-
-            df_baseline["Efficiency_%"] = (
-                (0.0001409 * df_baseline["Flow_input"] * df_baseline["Head_m"] / df_baseline["Power_input_kW"]) * 100
-            )
+            df_in = pd.read_excel(uploaded, engine=EXCEL_READ_ENGINE, header=None, usecols=[0, 1, 2], dtype=np.float64)
+            arr = df_in.to_numpy()
+            # skip leading blank rows, then keep rows up to the next one with a blank Flow, Head or Power
+            blank = np.isnan(arr).any(axis=1)
+            start = int(np.argmax(~blank)) if not blank.all() else len(arr)
+            rest = blank[start:]
+            end = start + (int(np.argmax(rest)) if rest.any() else len(rest))
+            df_baseline = build_baseline(arr[start:end, 0], arr[start:end, 1], arr[start:end, 2])
 
             st.success("✅ Excel data successfully read.")
             st.dataframe(df_baseline.head(10))
@@ -113,12 +251,10 @@ else:
         submitted = st.form_submit_button("Submit Manual Readings")
 
     if submitted:
-        df_baseline = pd.DataFrame(manual_data, columns=["Flow_input", "Head_m", "Power_input_kW"])
-        df_baseline = df_baseline[(df_baseline != 0).any(axis=1)]  # Remove all-zero rows
-
-        df_baseline["Efficiency_%"] = (
-            (0.0001409 * df_baseline["Flow_input"] * df_baseline["Head_m"] / df_baseline["Power_input_kW"]) * 100
-        )
+        arr = np.array(manual_data, dtype=np.float64)
+        keep = (arr != 0).any(axis=1)  # Remove all-zero rows
+        arr = arr[keep]
+        df_baseline = build_baseline(arr[:, 0], arr[:, 1], arr[:, 2], index=np.flatnonzero(keep))
 
         st.success("✅ Manual data submitted successfully.")
         st.dataframe(df_baseline)
@@ -130,10 +266,13 @@ if (mode == "📁 Upload Excel File" and uploaded) or (mode == "✏️ Manual En
         st.stop()
 
     try:
-        new_dias = [float(d.strip()) for d in new_dias_input.split(",") if d.strip()]
-        if not new_dias:
+        new_dias = parse_diameters(new_dias_input)
+        if new_dias.size == 0:
             st.warning("⚠️ Please enter at least one new impeller diameter.")
             st.stop()
+        if not np.all(new_dias > 0):
+            st.warning("⚠️ New impeller diameters must be positive numbers.")
+            st.stop()
     except ValueError:
         st.error("❌ Invalid format in new diameters. Use numbers separated by commas, e.g., 100,120,140.")
         st.stop()
@@ -144,29 +283,26 @@ if (mode == "📁 Upload Excel File" and uploaded) or (mode == "✏️ Manual En
     st.dataframe(df_result.round(decimals))
 
     # --- Graphs ---
-    import matplotlib.pyplot as plt
-
-    for D in new_dias:
-        fig1, ax1 = plt.subplots()
-        ax1.plot(df_result[f"Flow_D{D}"], df_result[f"Head_D{D}"], marker="o")
-        ax1.set_xlabel("Flow (LPM)")
-        ax1.set_ylabel("Head (m)")
-        ax1.set_title(f"Flow vs Head for Dia {D} mm")
-        st.pyplot(fig1)
-
-        fig2, ax2 = plt.subplots()
-        ax2.plot(df_result[f"Flow_D{D}"], df_result[f"Efficiency_D{D}"], marker="o")
-        ax2.set_xlabel("Flow (LPM)")
-        ax2.set_ylabel("Efficiency (%)")
-        ax2.set_title(f"Flow vs Efficiency for Dia {D} mm")
-        st.pyplot(fig2)
-
-        fig3, ax3 = plt.subplots()
-        ax3.plot(df_result[f"Flow_D{D}"], df_result[f"Power_kW_D{D}"], marker="o")
-        ax3.set_xlabel("Flow (LPM)")
-        ax3.set_ylabel("Power (kW)")
-        ax3.set_title(f"Flow vs Power for Dia {D} mm")
-        st.pyplot(fig3)
+    # long form (one row per sample and diameter) so each metric is one layered chart
+    n = len(df_result)
+    chart_df = pd.DataFrame({
+        "Sample": np.tile(np.arange(n), len(new_dias)),
+        "Diameter": np.repeat(new_dias, n),
+        "Flow": df_result[[f"Flow_D{D}" for D in new_dias]].to_numpy().ravel(order="F"),
+        "Head": df_result[[f"Head_D{D}" for D in new_dias]].to_numpy().ravel(order="F"),
+        "Efficiency": df_result[[f"Efficiency_D{D}" for D in new_dias]].to_numpy().ravel(order="F"),
+        "Power": df_result[[f"Power_kW_D{D}" for D in new_dias]].to_numpy().ravel(order="F")
+    })
+    base = alt.Chart(chart_df).mark_line(point=True).encode(
+        x=alt.X("Flow", title="Flow (LPM)"),
+        color=alt.Color("Diameter:N", title="Dia (mm)"),
+        order="Sample"
+    )
+    st.altair_chart(alt.vconcat(
+        base.encode(y=alt.Y("Head", title="Head (m)")).properties(title="Flow vs Head"),
+        base.encode(y=alt.Y("Efficiency", title="Efficiency (%)")).properties(title="Flow vs Efficiency"),
+        base.encode(y=alt.Y("Power", title="Power (kW)")).properties(title="Flow vs Power")
+    ))
 
     # --- Download output ---
     excel_bytes = build_excel_bytes(df_result, decimals)